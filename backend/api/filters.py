@@ -1,7 +1,8 @@
 import django_filters
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework
 from django_filters.rest_framework import FilterSet
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 
 
 class IngredientFilter(FilterSet):
@@ -20,34 +21,31 @@ class RecipeFilter(django_filters.FilterSet):
         queryset=Tag.objects.all(),
         field_name='tags__slug',
         to_field_name='slug')
-    is_favorited = django_filters.filters.NumberFilter(
-        method='get_is_favorited')
-    is_in_shopping_cart = django_filters.filters.NumberFilter(
-        method='get_is_in_shopping_cart')
-
-    def get_is_favorited(self, *args, **kwargs):
-        if self.request.user.is_authenticated:
-            if self.data.get('is_favorited') == '1':
-                return self.queryset.filter(
-                    favorites__user=self.request.user
-                )
-            else:
-                return self.queryset.exclude(
-                    favorites__user=self.request.user
-                )
-        return self.queryset
-
-    def get_is_in_shopping_cart(self, *args, **kwargs):
-        if self.request.user.is_authenticated:
-            if self.data.get('is_in_shopping_cart') == '1':
-                return self.queryset.filter(
-                    shopping_recipe__user=self.request.user
-                )
-            else:
-                return self.queryset.exclude(
-                    shopping_recipe__user=self.request.user
-                )
-        return self.queryset
+    is_favorited = rest_framework.BooleanFilter(
+        method='filter_is_favorited')
+    is_in_shopping_cart = rest_framework.BooleanFilter(
+        method='filter_is_in_shopping_cart')
+
+    def filter_by_user_relation(self, queryset, model, value):
+        """
+        Фильтрация рецептов по наличию связи model с пользователем
+        через EXISTS, без JOIN и дублирования строк.
+        """
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        condition = Exists(
+            model.objects.filter(user=user, recipe=OuterRef('pk'))
+        )
+        if value:
+            return queryset.filter(condition)
+        return queryset.exclude(condition)
+
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_by_user_relation(queryset, Favorite, value)
+
+    def filter_is_in_shopping_cart(self, queryset, name, value):
+        return self.filter_by_user_relation(queryset, ShoppingCart, value)
 
     class Meta:
         model = Recipe
@@ -1,5 +1,6 @@
 import csv
 
+from django.core.cache import caches
 from django.core.management.base import BaseCommand
 from foodgram.settings import CSV_FILES_DIR
 from recipes.models import Ingredient
@@ -27,5 +28,7 @@ class Command(BaseCommand):
                 for row in reader
             ]
             Ingredient.objects.bulk_create(ingredients)
+        # bulk_create не отправляет post_save, кэш сбрасывается явно.
+        caches['reference'].clear()
         print('Ингредиенты в базу данных загружены')
         print('ADD', Ingredient.objects.count(), 'Ingredient')
@@ -1,5 +1,6 @@
 import csv
 
+from django.core.cache import caches
 from django.core.management.base import BaseCommand
 from foodgram.settings import CSV_FILES_DIR
 from recipes.models import Tag
@@ -24,5 +25,6 @@ class Command(BaseCommand):
                 Tag.objects.create(
                     name=name, color=color, slug=slug
                 )
+        caches['reference'].clear()
         print('Теги в базу данных загружены')
         print('ADD', Tag.objects.count(), 'tags')
@@ -1,8 +1,62 @@
+import hashlib
+from functools import partial
+
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.utils.functional import cached_property
+from django.utils.http import urlencode
 from rest_framework.pagination import PageNumberPagination
 
 
+class CachedCountPaginator(Paginator):
+    """Паджинатор, который берет количество объектов из кэша."""
+
+    def __init__(self, object_list, per_page, cache_key, timeout,
+                 refresh=False, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.cache_key = cache_key
+        self.timeout = timeout
+        self.refresh = refresh
+
+    @cached_property
+    def count(self):
+        count = None if self.refresh else cache.get(self.cache_key)
+        if count is None:
+            count = super().count
+            cache.set(self.cache_key, count, self.timeout)
+        return count
+
+
 class CustomPagination(PageNumberPagination):
     """Кастомный пагинатор для вывода 6 элементов на странице."""
 
     page_size_query_param = 'limit'
     page_size = 6
+    count_cache_timeout = 60 * 5
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Количество объектов кэшируется для набора параметров запроса,
+        на первой странице оно пересчитывается.
+        """
+        page_number = request.query_params.get(self.page_query_param, '1')
+        self.django_paginator_class = partial(
+            CachedCountPaginator,
+            cache_key=self.get_count_cache_key(request),
+            timeout=self.count_cache_timeout,
+            refresh=page_number == '1',
+        )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_count_cache_key(self, request):
+        params = sorted(
+            (key, sorted(values))
+            for key, values in request.query_params.lists()
+            if key != self.page_query_param
+        )
+        signature = (
+            f'{request.path}:{request.user.pk}:{urlencode(params, True)}'
+        )
+        return 'pagination_count:' + hashlib.md5(
+            signature.encode()
+        ).hexdigest()
@@ -1,11 +1,14 @@
-import base64
+import binascii
+import copy
 
 from django.core.files.base import ContentFile
-from django.shortcuts import get_object_or_404
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Prefetch
 from recipes.models import (Favorite, Follow, Ingredient, IngredientInRecipe,
                             Recipe, ShoppingCart, Tag, )
 from rest_framework import serializers
 from rest_framework.serializers import ModelSerializer
+from rest_framework.settings import api_settings
 
 from users.models import User
 
@@ -16,14 +19,80 @@ class Base64ImageField(serializers.ImageField):
         """Преобразование картинки"""
 
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='photo.' + ext)
+            header, _, imgstr = data.partition(';base64,')
+            ext = header.rpartition('/')[2]
+            try:
+                data = ContentFile(
+                    binascii.a2b_base64(imgstr), name='photo.' + ext
+                )
+            except (binascii.Error, ValueError):
+                self.fail('invalid_image')
 
         return super().to_internal_value(data)
 
 
-class TagSerializer(ModelSerializer):
+class CachedFieldsMixin:
+    """
+    Кэширование полей сериализатора на уровне класса.
+    Поля собираются один раз, а каждому экземпляру сериализатора
+    выдаются их поверхностные копии вместо повторного deepcopy.
+    """
+
+    _fields_cache = {}
+
+    def get_fields(self):
+        cls = type(self)
+        if cls not in self._fields_cache:
+            self._fields_cache[cls] = super().get_fields()
+        return {
+            name: self.copy_field(field)
+            for name, field in self._fields_cache[cls].items()
+        }
+
+    @classmethod
+    def copy_field(cls, field):
+        """
+        Копия поля, которую можно привязать к новому сериализатору.
+        Вложенные поля ListSerializer, ListField (child) и
+        ManyRelatedField (child_relation) тоже копируются,
+        чтобы их parent указывал на копию, а не на закэшированное поле.
+        """
+        field = copy.copy(field)
+        for attr in ('child', 'child_relation'):
+            child = getattr(field, attr, None)
+            if child is not None:
+                child = cls.copy_field(child)
+                child.parent = field
+                setattr(field, attr, child)
+        return field
+
+
+class UniqueCreateMixin:
+    """
+    Создание записи, повтор которой отсекается уникальным ограничением
+    в БД, без предварительного запроса на существование записи.
+    Текст ошибки задается шаблоном duplicate_message, в который
+    подставляются провалидированные данные.
+    """
+
+    duplicate_message = None
+
+    def get_duplicate_message(self, validated_data):
+        return self.duplicate_message.format(**validated_data)
+
+    def create(self, validated_data):
+        try:
+            with transaction.atomic():
+                return super().create(validated_data)
+        except IntegrityError:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [
+                    self.get_duplicate_message(validated_data)
+                ]
+            })
+
+
+class TagSerializer(CachedFieldsMixin, ModelSerializer):
     """Вывод тэгов."""
 
     class Meta:
@@ -31,7 +100,7 @@ class TagSerializer(ModelSerializer):
         fields = ('id', 'name', 'color', 'slug')
 
 
-class IngredientSerializer(ModelSerializer):
+class IngredientSerializer(CachedFieldsMixin, ModelSerializer):
     """вывод ингредиентов."""
 
     class Meta:
@@ -39,7 +108,7 @@ class IngredientSerializer(ModelSerializer):
         fields = ('id', 'name', 'measurement_unit')
 
 
-class UsersSerializer(serializers.ModelSerializer):
+class UsersSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор выдачи информации о user.
     """
@@ -59,14 +128,24 @@ class UsersSerializer(serializers.ModelSerializer):
     def get_is_subscribed(self, obj):
         """
         Проверка на подписку.
+        Берется из аннотации is_subscribed, если она есть, иначе
+        авторы, на которых подписан пользователь, загружаются
+        одним запросом и запоминаются в контексте сериализатора.
         """
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user_me = self.context['request'].user
         if not user_me.is_authenticated:
             return False
-        return user_me.follower.filter(author=obj).exists()
+        if 'followed_ids' not in self.context:
+            self.context['followed_ids'] = set(
+                user_me.follower.values_list('author_id', flat=True)
+            )
+        return obj.id in self.context['followed_ids']
 
 
-class IngredientInRecipeSerializer(serializers.ModelSerializer):
+class IngredientInRecipeSerializer(CachedFieldsMixin,
+                                   serializers.ModelSerializer):
     id = serializers.ReadOnlyField(source='ingredient.id')
     name = serializers.ReadOnlyField(source='ingredient.name')
     measurement_unit = serializers.ReadOnlyField(
@@ -77,13 +156,13 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         fields = ('id', 'name', 'measurement_unit', 'amount')
 
 
-class RecipeViewSerializer(serializers.ModelSerializer):
+class RecipeViewSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     tags = TagSerializer(many=True)
     author = UsersSerializer()
     ingredients = IngredientInRecipeSerializer(
         source='ingredient_list', many=True)
-    is_favorited = serializers.SerializerMethodField()
-    is_in_shopping_cart = serializers.SerializerMethodField()
+    is_favorited = serializers.BooleanField(read_only=True)
+    is_in_shopping_cart = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Recipe
@@ -100,28 +179,8 @@ class RecipeViewSerializer(serializers.ModelSerializer):
             'cooking_time',
         )
 
-    def get_is_favorited(self, obj):
-        """Проверка на добавление в избранное."""
 
-        request = self.context['request'].user
-        if not request.is_authenticated:
-            return False
-        return Favorite.objects.filter(
-            user=request, recipe=obj
-        ).exists()
-
-    def get_is_in_shopping_cart(self, obj):
-        """проверка на наличие  в корзине."""
-
-        request = self.context['request'].user
-        if not request.is_authenticated:
-            return False
-        return ShoppingCart.objects.filter(
-            user=request, recipe=obj
-        ).exists()
-
-
-class RecipeSerializer(serializers.ModelSerializer):
+class RecipeSerializer(CachedFieldsMixin, serializers.ModelSerializer):
     """
     Сериализатор для выдачи рецепта(ов) с общей информацией.
     """
@@ -174,65 +233,101 @@ class CreateRecipeSerializer(serializers.ModelSerializer):
     def to_representation(self, instance):
         """Представление модели"""
 
+        request = self.context.get('request')
+        instance = Recipe.objects.with_related().annotate_user_flags(
+            request.user
+        ).get(pk=instance.pk)
         serializer = RecipeViewSerializer(
             instance,
             context={
-                'request': self.context.get('request')
+                'request': request
             }
         )
         return serializer.data
 
-    def validate(self, data):
+    @staticmethod
+    def validate_ingredients(value):
         """Валидация ингредиентов"""
 
-        ingredients = self.initial_data.get('ingredients')
-        lst_ingredient = []
+        ingredient_ids = [ingredient['id'] for ingredient in value]
+        submitted = set(ingredient_ids)
+        if len(ingredient_ids) != len(submitted):
+            raise serializers.ValidationError(
+                'Ингредиенты должны быть уникальными!'
+            )
+        missing = submitted - set(Ingredient.objects.filter(
+            pk__in=submitted
+        ).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError(
+                'Ингредиенты не найдены: '
+                f'{", ".join(map(str, sorted(missing)))}'
+            )
+        return value
 
-        for ingredient in ingredients:
-            if ingredient['id'] in lst_ingredient:
-                raise serializers.ValidationError(
-                    'Ингредиенты должны быть уникальными!'
-                )
-            lst_ingredient.append(ingredient['id'])
-        return data
+    @staticmethod
+    def validate_tags(value):
+        """Валидация тегов"""
 
-    def recipe_create_or_update(self, instance, validated_data):
+        if len(value) != len(set(value)):
+            raise serializers.ValidationError(
+                'Теги должны быть уникальными!'
+            )
+        return value
+
+    @staticmethod
+    def create_ingredients(recipe, ingredients):
         """
-        Метод для создания или обновления ингредиентов и тегов.
+        Метод для создания ингредиентов рецепта одним запросом.
         """
-        ingredients, tags = (
-            validated_data.pop('ingredients'), validated_data.pop('tags')
-        )
-        for item in ingredients:
-            cur_obj, _ = IngredientInRecipe.objects.get_or_create(
-                recipe=instance,
-                ingredient=get_object_or_404(Ingredient, pk=item['id']),
+        IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(
+                recipe=recipe,
+                ingredient_id=item['id'],
                 amount=item['amount']
             )
-        for item in tags:
-            instance.tags.add(item)
-
-        return instance
+            for item in ingredients
+        ])
 
+    @transaction.atomic
     def create(self, validated_data):
-        raw_data = {
-            'ingredients': validated_data.pop('ingredients'),
-            'tags': validated_data.pop('tags')
-        }
+        ingredients = validated_data.pop('ingredients')
+        tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        return self.recipe_create_or_update(recipe, raw_data)
+        Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag=tag) for tag in tags
+        ])
+        self.create_ingredients(recipe, ingredients)
+        return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        instance.ingredients.clear()
-        instance.tags.clear()
-        instance = self.recipe_create_or_update(instance, validated_data)
+        """
+        При частичном обновлении ингредиенты и теги заменяются,
+        только если они переданы в запросе.
+        """
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            IngredientInRecipe.objects.filter(recipe=instance).delete()
+            self.create_ingredients(instance, ingredients)
+        if tags is not None:
+            instance.tags.set(tags)
         return super().update(instance, validated_data)
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
+class FavoriteSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     """
     Сериализатор для выдачи избранных рецептов.
     """
+    user = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.only('id')
+    )
+    recipe = serializers.PrimaryKeyRelatedField(
+        queryset=Recipe.objects.only('id', 'name', 'image', 'cooking_time')
+    )
+
+    duplicate_message = 'Рецепт - {recipe} уже есть в избранном'
 
     class Meta:
         model = Favorite
@@ -241,16 +336,6 @@ class FavoriteSerializer(serializers.ModelSerializer):
             'recipe'
         )
 
-    def validate(self, data):
-        if Favorite.objects.filter(
-                user=data['user'],
-                recipe=data['recipe']
-        ):
-            raise serializers.ValidationError(
-                f'Рецепт - {data["recipe"]} уже есть в избранном'
-            )
-        return data
-
     def to_representation(self, instance):
         return RecipeSerializer(instance.recipe).data
 
@@ -259,7 +344,7 @@ class FollowSerializer(UsersSerializer):
     """
     Сериализатор для выдачи подписок.
     """
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.IntegerField(read_only=True)
     recipes = serializers.SerializerMethodField()
 
     class Meta:
@@ -282,29 +367,43 @@ class FollowSerializer(UsersSerializer):
         """
         request = self.context.get('request')
         recipes_limit = request.query_params.get('recipes_limit')
+        recipes = author.recipes.all()
         if recipes_limit:
-            return RecipeSerializer(
-                Recipe.objects.filter(author=author)[:int(recipes_limit)],
-                context={'queryset': request},
-                many=True
-            ).data
+            recipes = recipes[:int(recipes_limit)]
         return RecipeSerializer(
-            Recipe.objects.filter(author=author),
+            recipes,
             context={'queryset': request},
             many=True
         ).data
 
-    def get_recipes_count(self, obj):
+    @staticmethod
+    def setup_eager_loading(queryset):
         """
-        Подсчет количества рецептов автора.
+        Подсчет количества рецептов авторов и загрузка самих рецептов
+        одним запросом на всю выборку.
         """
-        return obj.recipes.count()
+        return queryset.annotate(
+            recipes_count=Count('recipes')
+        ).prefetch_related(Prefetch(
+            'recipes',
+            queryset=Recipe.objects.only(
+                'id', 'author', 'name', 'image', 'cooking_time'
+            )
+        ))
 
 
-class FollowPostSerializer(serializers.ModelSerializer):
+class FollowPostSerializer(UniqueCreateMixin, serializers.ModelSerializer):
     """
     Сериализатор для создание запроса на подписку.
     """
+    author = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.only('id', 'username')
+    )
+    user = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.only('id')
+    )
+
+    duplicate_message = 'Вы подписаны на автора {author}!'
 
     class Meta:
         model = Follow
@@ -319,25 +418,31 @@ class FollowPostSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 'Нельзя подписываться на самого себя!'
             )
-        if Follow.objects.filter(
-                author=data['author'],
-                user=user_me):
-            raise serializers.ValidationError(
-                f'Вы подписаны на автора {data["author"]}!'
-            )
         return data
 
     def to_representation(self, instance):
+        author = FollowSerializer.setup_eager_loading(
+            User.objects.filter(pk=instance.author_id)
+        ).get()
         return FollowSerializer(
-            instance.author,
+            author,
             context={'request': self.context.get('request')}
         ).data
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(UniqueCreateMixin,
+                             serializers.ModelSerializer):
     """
     Сериализатор для списка покупок автора.
     """
+    user = serializers.PrimaryKeyRelatedField(
+        queryset=User.objects.only('id')
+    )
+    recipe = serializers.PrimaryKeyRelatedField(
+        queryset=Recipe.objects.only('id', 'name', 'image', 'cooking_time')
+    )
+
+    duplicate_message = 'Рецепт - {recipe} уже есть в списке покупок'
 
     class Meta:
         model = ShoppingCart
@@ -346,15 +451,5 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
             'recipe'
         )
 
-    def validate(self, data):
-        if ShoppingCart.objects.filter(
-                user=data['user'],
-                recipe=data['recipe']
-        ):
-            raise serializers.ValidationError(
-                f'Рецепт - {data["recipe"]} уже есть в списке покупок'
-            )
-        return data
-
     def to_representation(self, instance):
         return RecipeSerializer(instance.recipe).data
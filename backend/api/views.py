@@ -1,3 +1,5 @@
+import hashlib
+
 from recipes.models import (IngredientInRecipe,
                             ShoppingCart)
 from rest_framework import viewsets
@@ -10,19 +12,21 @@ from .serializer import (FavoriteSerializer,
                          )
 
 from recipes.models import Follow
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.core.cache import caches
+from django.db.models import Exists, OuterRef, Sum
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer, UserCreateSerializer
 from recipes.models import (Favorite, Ingredient, Recipe,
                             Tag)
 from rest_framework import mixins, permissions, status
 from rest_framework.decorators import action
-from rest_framework.exceptions import ValidationError
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
-from rest_framework.viewsets import GenericViewSet, ModelViewSet
+from rest_framework.viewsets import GenericViewSet
 
 from .filters import IngredientFilter, RecipeFilter
 
@@ -34,8 +38,49 @@ from .serializer import (FollowPostSerializer,
 
 User = get_user_model()
 
+AUTH_ACTIONS = frozenset((
+    'retrieve',
+    'me',
+    'set_password',
+    'subscribe',
+    'subscriptions',
+))
+
+
+class ReferenceCacheMixin:
+    """
+    Кэширование сериализованных списков и объектов справочника
+    в кэше 'reference' на стороне сервера. Заголовки кэширования
+    клиенту не отдаются, данные устаревают только при сбросе кэша
+    сигналами или командами загрузки.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        data = caches['reference'].get_or_set(
+            self.get_reference_cache_key(request),
+            lambda: handler(request, *args, **kwargs).data,
+            settings.REFERENCE_CACHE_TIMEOUT,
+        )
+        return Response(data)
+
+    @staticmethod
+    def get_reference_cache_key(request):
+        return 'reference:' + hashlib.md5(
+            request.get_full_path().encode()
+        ).hexdigest()
+
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет работы с обьектами класса Tag."""
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
@@ -43,16 +88,22 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(ReferenceCacheMixin, viewsets.ReadOnlyModelViewSet):
     """Вьюсет для работы с обьектами класса Ingredient."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
-    search_fields = ('^name',)
     pagination_class = None
 
+    def filter_queryset(self, queryset):
+        """Без параметров запроса фильтры не применяются."""
+
+        if not self.request.query_params:
+            return queryset
+        return super().filter_queryset(queryset)
+
 
 class UsersViewSet(mixins.ListModelMixin,
                    mixins.CreateModelMixin,
@@ -65,11 +116,22 @@ class UsersViewSet(mixins.ListModelMixin,
 
     def get_queryset(self):
         if self.action == 'subscriptions':
-            subscriptions = self.request.user.follower.values('author')
-            return User.objects.filter(
-                pk__in=[pk['author'] for pk in subscriptions]
+            queryset = FollowSerializer.setup_eager_loading(
+                User.objects.filter(
+                    follow__user=self.request.user
+                ).order_by('id')
             )
-        return User.objects.order_by('id').all()
+        else:
+            queryset = User.objects.only(
+                'id', 'username', 'email', 'first_name', 'last_name'
+            )
+        if self.request.user.is_authenticated:
+            queryset = queryset.annotate(is_subscribed=Exists(
+                Follow.objects.filter(
+                    user=self.request.user, author=OuterRef('pk')
+                )
+            ))
+        return queryset
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -83,14 +145,8 @@ class UsersViewSet(mixins.ListModelMixin,
         return UsersSerializer
 
     def get_permissions(self):
-        if self.action in (
-                'retrieve',
-                'me',
-                'set_password',
-                'subscribe',
-                'subscriptions'
-        ):
-            self.permission_classes = [permissions.IsAuthenticated]
+        if self.action in AUTH_ACTIONS:
+            return [permissions.IsAuthenticated()]
         return super().get_permissions()
 
     @action(['get'], detail=False)
@@ -118,14 +174,18 @@ class UsersViewSet(mixins.ListModelMixin,
     @action(methods=['POST'], detail=True)
     def subscribe(self, request, *args, **kwargs):
         data = {
-            'author': self.get_object().pk,
+            'author': kwargs['pk'],
             'user': self.request.user.pk,
         }
-        serializer = FollowPostSerializer(
-            data=data,
-            context={'request': request}
-        )
-        serializer.is_valid(raise_exception=True)
+        serializer = self.get_serializer(data=data)
+        if not serializer.is_valid():
+            # Несуществующий автор из URL дает 404, как при get_object.
+            if any(
+                error.code in ('does_not_exist', 'incorrect_type')
+                for error in serializer.errors.get('author', ())
+            ):
+                raise NotFound()
+            raise ValidationError(serializer.errors)
         serializer.save()
         return Response(
             data=serializer.data,
@@ -134,31 +194,58 @@ class UsersViewSet(mixins.ListModelMixin,
 
     @subscribe.mapping.delete
     def subscribe_delete(self, request, pk):
-        follow = Follow.objects.filter(
-            author=self.get_object(),
-            user=self.request.user
-        )
-        if not follow:
+        """
+        Отписка одним DELETE. Существование автора проверяется,
+        только если удалять было нечего.
+        """
+        try:
+            deleted, _ = Follow.objects.filter(
+                author_id=pk,
+                user=self.request.user
+            ).delete()
+        except (TypeError, ValueError):
+            raise NotFound()
+        if not deleted:
+            get_object_or_404(User.objects.only('id'), pk=pk)
             raise ValidationError(
                 'Вы не были подписаны на автора'
             )
-        follow.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(mixins.ListModelMixin,
+                    mixins.RetrieveModelMixin,
+                    mixins.CreateModelMixin,
+                    mixins.UpdateModelMixin,
+                    mixins.DestroyModelMixin,
+                    GenericViewSet):
     """ViewSet для обработки запросов, связанных с рецептами."""
     queryset = Recipe.objects.all()
+    http_method_names = ['get', 'post', 'patch', 'delete', 'head', 'options']
     permission_classes = (IsAuthorOrReadOnly,)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    def get_queryset(self):
+        """
+        Метод для получения рецептов вместе с автором, тегами,
+        ингредиентами и отметками избранного и корзины,
+        чтобы не делать запрос на каждый рецепт.
+        """
+
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            queryset = queryset.with_related().annotate_user_flags(
+                self.request.user
+            )
+        return queryset
+
     def get_serializer_class(self):
         """Метод для вызова определенного сериализатора. """
 
         if self.action in ('list', 'retrieve'):
             return RecipeViewSerializer
-        elif self.action in ('create', 'partial_update'):
+        elif self.action in ('create', 'update', 'partial_update'):
             return CreateRecipeSerializer
 
     def get_serializer_context(self):
@@ -177,10 +264,9 @@ class RecipeViewSet(ModelViewSet):
     )
     def favorite(self, request, pk):
         """Метод для управления избранными подписками """
-        recipe = get_object_or_404(Recipe, id=pk)
         data = {
             'user': request.user.pk,
-            'recipe': recipe.pk
+            'recipe': pk
         }
         serializer = FavoriteSerializer(data=data)
         serializer.is_valid(raise_exception=True)
@@ -195,15 +281,14 @@ class RecipeViewSet(ModelViewSet):
         и удаляет его.
         """
 
-        favorite = Favorite.objects.filter(
+        deleted, _ = Favorite.objects.filter(
             user=request.user.pk,
-            recipe=get_object_or_404(Recipe, pk=pk)
-        )
-        if not favorite:
+            recipe_id=pk
+        ).delete()
+        if not deleted:
             raise ValidationError(
                 'Рецепта в избранном нет!'
             )
-        favorite.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -215,10 +300,9 @@ class RecipeViewSet(ModelViewSet):
     )
     def shopping_cart(self, request, *args, **kwargs):
         """Метод для управления списком покупок"""
-        recipe = get_object_or_404(Recipe, id=self.kwargs['pk'])
         data = {
             'user': request.user.pk,
-            'recipe': recipe.pk
+            'recipe': self.kwargs['pk']
         }
         serializer = ShoppingCartSerializer(data=data)
         serializer.is_valid(raise_exception=True)
@@ -227,29 +311,24 @@ class RecipeViewSet(ModelViewSet):
 
     @shopping_cart.mapping.delete
     def shopping_cart_delete(self, request, pk):
-        shopping = ShoppingCart.objects.filter(
+        deleted, _ = ShoppingCart.objects.filter(
             user=request.user.pk,
-            recipe=get_object_or_404(Recipe, id=pk)
-        )
-        if not shopping:
+            recipe_id=pk
+        ).delete()
+        if not deleted:
             raise ValidationError(
                 'Рецепта в спске покупок нет!'
             )
-        shopping.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @staticmethod
     def ingredients_to_txt(ingredients):
-        """Метод для объединения ингредиентов в список для загрузки"""
-
-        shopping_list = ''
-        for ingredient in ingredients:
-            shopping_list += (
-                f"{ingredient['ingredient__name']}  - "
-                f"{ingredient['sum']}"
-                f"({ingredient['ingredient__measurement_unit']})\n"
-            )
-        return shopping_list
+        """Генератор строк списка ингредиентов для загрузки"""
+
+        for name, measurement_unit, amount in ingredients.iterator(
+                chunk_size=500
+        ):
+            yield f'{name}  - {amount}({measurement_unit})\n'
 
     @action(
         detail=False,
@@ -262,14 +341,18 @@ class RecipeViewSet(ModelViewSet):
         """Метод для загрузки ингредиентов и их количества
          для выбранных рецептов"""
 
+        if not ShoppingCart.objects.filter(user=request.user).exists():
+            return HttpResponse(content_type='text/plain')
         ingredients = IngredientInRecipe.objects.filter(
             recipe__shopping_recipe__user=request.user
-        ).values(
+        ).values_list(
             'ingredient__name',
             'ingredient__measurement_unit'
-        ).annotate(sum=Sum('amount'))
-        shopping_list = self.ingredients_to_txt(ingredients)
-        return HttpResponse(shopping_list, content_type='text/plain')
+        ).annotate(sum=Sum('amount')).order_by('ingredient__name')
+        return StreamingHttpResponse(
+            self.ingredients_to_txt(ingredients),
+            content_type='text/plain'
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
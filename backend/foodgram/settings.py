@@ -131,6 +131,23 @@ REST_FRAMEWORK = {
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Кэш 'reference' хранит ответы справочников тегов и ингредиентов и
+# сбрасывается сигналами и командами загрузки данных. Он лежит в файлах,
+# чтобы сброс из любого процесса (воркеры gunicorn, manage.py)
+# был виден всем остальным.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'reference': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache', 'reference'),
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+}
+
+REFERENCE_CACHE_TIMEOUT = 60 * 60
+
 
 # DJOSER = {
 #     'LOGIN_FIELD': 'email',
@@ -0,0 +1,32 @@
+from django.db import migrations
+
+INDEX_NAME = 'recipes_ingredient_name_upper_like'
+
+
+def create_index(apps, schema_editor):
+    # istartswith в PostgreSQL компилируется в
+    # UPPER("name"::text) LIKE UPPER(%s), поэтому индекс строится
+    # по тому же выражению с text_pattern_ops (работает при любой локали).
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        f'CREATE INDEX IF NOT EXISTS {INDEX_NAME} '
+        'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)'
+    )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(f'DROP INDEX IF EXISTS {INDEX_NAME}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -1,6 +1,7 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator, RegexValidator
 from django.db import models
+from django.db.models import Exists, OuterRef, Prefetch, Value
 
 User = get_user_model()
 
@@ -65,6 +66,46 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
+class RecipeQuerySet(models.QuerySet):
+    """QuerySet рецептов с отметками пользователя."""
+
+    def with_related(self):
+        """
+        Подгружает автора, теги и ингредиенты рецептов
+        фиксированным числом запросов.
+        """
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredient_list',
+                queryset=IngredientInRecipe.objects.select_related(
+                    'ingredient'
+                )
+            )
+        )
+
+    def annotate_user_flags(self, user):
+        """
+        Добавляет к рецептам is_favorited и is_in_shopping_cart
+        подзапросами EXISTS, вместо отдельного запроса на каждый рецепт.
+        """
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()
+                ),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+
 class Recipe(models.Model):
     """Модель для описания рецепта."""
 
@@ -109,6 +150,8 @@ class Recipe(models.Model):
         verbose_name='Дата публикации рецепта'
     )
 
+    objects = RecipeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'